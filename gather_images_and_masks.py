@@ -1,12 +1,29 @@
 #!/usr/bin/env python3
 import argparse
+import os
 import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
 MASK_SUFFIX = "_mask"
 
+def iter_media_files(folder: Path, exts: Set[str]) -> Iterable[Path]:
+    stack = [str(folder)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(e.path)
+                    continue
+                name = e.name
+                dot = name.rfind(".")
+                if dot > 0 and name[dot:].lower() in exts and e.is_file():
+                    yield Path(e.path)
+
 def find_dir_exact_or_prefix(base: Path, exact: str, prefix: str) -> Optional[Path]:
     """Prefer an exact subdir name; if missing, fall back to the first that startswith(prefix)."""
     exact_dir = base / exact
@@ -17,31 +34,16 @@ def find_dir_exact_or_prefix(base: Path, exact: str, prefix: str) -> Optional[Pa
             return p
     return None
 
-def choose_mask_for(basename: str, mask_dir: Path)  -> Optional[Path]:
+def choose_mask_for(key: str, mask_by_base: Dict[str, Path]) -> Optional[Path]:
     """
-    Try common patterns to locate the corresponding mask file.
-    Priority:
-      1) <basename>_mask.<ext>
-      2) exact name match with suffix already present in basename
-    Falls back to first file that startswith(basename) and contains '_mask'.
+    Locate the mask <basename>_mask.<ext> with one lookup in the per-split index
+    (keyed by lowercase base). `key` is the image basename already lowercased.
     """
-    # strict pattern
-    for ext in IMG_EXTS:
-        cand = mask_dir / f"{basename}{MASK_SUFFIX}{ext}"
-        if cand.exists():
-            return cand
-    # relaxed pattern
-    candidates: List[Path] = []
-    for p in mask_dir.iterdir():
-        if p.is_file() and p.suffix.lower() in IMG_EXTS:
-            st = p.stem.lower()
-            if st.startswith(basename.lower()) and MASK_SUFFIX in st:
-                candidates.append(p)
-    if len(candidates) == 1:
-        return candidates[0]
-    return None
+    return mask_by_base.get(key)
 
-def copy_file(src: Path, dst: Path, dry_run: bool = False, hardlink: bool = False) -> None:
+def copy_file(
+    src: Path, dst: Path, dry_run: bool = False, hardlink: bool = False, reflink: bool = False
+) -> None:
     dst.parent.mkdir(parents=True, exist_ok=True)
     if dry_run:
         print(f"[DRY] {src} -> {dst}")
@@ -54,10 +56,32 @@ def copy_file(src: Path, dst: Path, dry_run: bool = False, hardlink: bool = Fals
             return
         except Exception:
             pass
+    if reflink:
+        # coreutils clones extents on CoW filesystems (btrfs/xfs) and copies elsewhere
+        try:
+            if subprocess.run(["cp", "--reflink=auto", str(src), str(dst)]).returncode == 0:
+                shutil.copystat(src, dst)
+                return
+        except FileNotFoundError:
+            pass  # no cp on this system
+    # copyfile already copies in-kernel on Linux (sendfile) and raises SameFileError
+    # instead of truncating when dst is src (e.g. a hardlink from a previous run)
     shutil.copy2(src, dst)
 
+def copy_job(
+    job: Tuple[Path, Path], dry_run: bool, hardlink: bool, reflink: bool = False
+) -> None:
+    dst, src = job
+    copy_file(src, dst, dry_run=dry_run, hardlink=hardlink, reflink=reflink)
+
 def process_split(
-    data_dir: Path, out_img: Path, out_mask: Path, dry_run: bool, hardlink: bool
+    data_dir: Path,
+    out_img: Path,
+    out_mask: Path,
+    dry_run: bool,
+    hardlink: bool,
+    workers: Optional[int] = None,
+    reflink: bool = False,
 ) -> Tuple[int, int, List[str], List[str]]:
     """
     Returns: (num_imgs_copied, num_masks_copied, imgs_without_mask, extra_masks)
@@ -76,45 +100,54 @@ def process_split(
         print(f"[WARN] Skipping {data_dir.name}: missing images_/masks_ folder(s).")
         return 0, 0, [], []
 
-    images = [
-        p for p in images_dir.rglob("*")
-        if p.is_file() and p.suffix.lower() in IMG_EXTS
-    ]
-    masks = [
-        p for p in masks_dir.rglob("*")
-        if p.is_file() and p.suffix.lower() in IMG_EXTS
-    ]
+    # (path, stem, lowercase stem): lowercase once, reuse for every lookup
+    images = [(p, p.stem, p.stem.lower()) for p in iter_media_files(images_dir, IMG_EXTS)]
+    masks = [(p, p.stem, p.stem.lower()) for p in iter_media_files(masks_dir, IMG_EXTS)]
 
-    # Index mask stems for later 'extra' detection
-    mask_stems: Dict[str, List[Path]] = {}
-    for m in masks:
-        mask_stems.setdefault(m.stem.lower(), []).append(m)
+    # <base>_mask -> mask, built once so every image is a dict lookup
+    mask_by_base: Dict[str, Path] = {}
+    for m, _, st in masks:
+        if st.endswith(MASK_SUFFIX):
+            mask_by_base.setdefault(st.removesuffix(MASK_SUFFIX), m)
 
     copied_imgs = copied_masks = 0
     imgs_without_mask: List[str] = []
-    matched_mask_stems: set[str] = set()
+    mask_paths: List[Optional[Path]] = []
 
-    for img in images:
-        base = img.stem  # without extension
+    # Plan every copy first, keyed by destination: dup.jpg/dup.png share one mask,
+    # and equal stems in sub-folders share one name. Each destination is written
+    # once (last source wins, as in a serial loop), so threads never race on a file.
+    copies: Dict[Path, Path] = {}
+    for img, base, key in images:  # base: without extension
         # destination file keeps source extension
-        img_dst = out_img / f"{split_tag}_{base}{img.suffix.lower()}"
-        copy_file(img, img_dst, dry_run=dry_run, hardlink=hardlink)
+        copies[out_img / f"{split_tag}_{base}{img.suffix.lower()}"] = img
         copied_imgs += 1
 
-        mask_path = choose_mask_for(base, masks_dir)
+        mask_path = choose_mask_for(key, mask_by_base)
+        mask_paths.append(mask_path)
         if mask_path is None:
             imgs_without_mask.append(f"{split_tag}:{base}")
         else:
-            mask_dst = out_mask / f"{split_tag}_{base}{MASK_SUFFIX}{mask_path.suffix.lower()}"
-            copy_file(mask_path, mask_dst, dry_run=dry_run, hardlink=hardlink)
+            copies[out_mask / f"{split_tag}_{base}{MASK_SUFFIX}{mask_path.suffix.lower()}"] = mask_path
             copied_masks += 1
-            matched_mask_stems.add(mask_path.stem.lower())
+
+    worker = partial(copy_job, dry_run=dry_run, hardlink=hardlink, reflink=reflink)
+    if dry_run:
+        # only prints: stay on the main thread so [DRY] lines never interleave
+        for job in copies.items():
+            worker(job)
+    else:
+        # Copies/hardlinks are I/O-bound: overlap them with threads (no pickling needed)
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            list(ex.map(worker, copies.items()))
+
+    matched_mask_stems = {m.stem.lower() for m in mask_paths if m is not None}
 
     # masks that look like masks but didn't match any image
     extra_masks: List[str] = []
-    for m in masks:
-        if (MASK_SUFFIX in m.stem.lower()) and (m.stem.lower() not in matched_mask_stems):
-            extra_masks.append(f"{split_tag}:{m.stem}")
+    for _, stem, st in masks:
+        if (MASK_SUFFIX in st) and (st not in matched_mask_stems):
+            extra_masks.append(f"{split_tag}:{stem}")
 
     return copied_imgs, copied_masks, imgs_without_mask, extra_masks
 
@@ -126,9 +159,14 @@ def main():
     ap.add_argument("--out", type=Path, required=True, help="Output root (creates 'img' and 'mask')")
     ap.add_argument("--dry-run", action="store_true", help="List planned actions without copying")
     ap.add_argument("--hardlink", action="store_true", help="Try hardlinks instead of copies when possible")
+    ap.add_argument("--reflink", action="store_true",
+                    help="Copy with 'cp --reflink=auto' (instant clones on CoW filesystems like btrfs/xfs)")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="Number of copy threads (default: min(32, CPU count + 4))")
     args = ap.parse_args()
 
     out_img = args.out / "img"
+    workers = None if args.workers is None else max(1, args.workers)
     out_mask = args.out / "mask"
 
     splits = sorted([p for p in args.root.iterdir() if p.is_dir() and p.name.lower().startswith("data_c")])
@@ -142,7 +180,9 @@ def main():
 
     print(f"Found splits: {[p.name for p in splits]}")
     for d in splits:
-        ni, nm, missing, extra = process_split(d, out_img, out_mask, args.dry_run, args.hardlink)
+        ni, nm, missing, extra = process_split(
+            d, out_img, out_mask, args.dry_run, args.hardlink, workers, args.reflink
+        )
         print(f"[{d.name}] images={ni}, masks={nm}, missing_masks={len(missing)}, extra_masks={len(extra)}")
         total_i += ni
         total_m += nm
@@ -1,55 +1,344 @@
 #!/usr/bin/env python3
 import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from importlib.util import find_spec
 from pathlib import Path
-from typing import Tuple, Optional, Set
+from typing import Dict, Iterable, List, Tuple, Optional, Set
+import cv2
+import numpy as np
 from PIL import Image
 
 IMG_EXTS: Set[str] = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+JPEG_EXTS: Set[str] = {".jpg", ".jpeg"}
 
-def is_image_file(p: Path) -> bool:
-    return p.is_file() and p.suffix.lower() in IMG_EXTS and not p.name.startswith(".")
+# libjpeg can decode at 1/2, 1/4, 1/8 scale in the DCT domain (like PIL's Image.draft)
+REDUCED_FLAGS = {
+    # factor: (grayscale flag, color flag)
+    8: (cv2.IMREAD_REDUCED_GRAYSCALE_8, cv2.IMREAD_REDUCED_COLOR_8),
+    4: (cv2.IMREAD_REDUCED_GRAYSCALE_4, cv2.IMREAD_REDUCED_COLOR_4),
+    2: (cv2.IMREAD_REDUCED_GRAYSCALE_2, cv2.IMREAD_REDUCED_COLOR_2),
+}
 
-def load_image(p: Path) -> Image.Image:
-    # Convert images to RGB (3 channels). Adjust if you prefer to preserve modes.
-    return Image.open(p)
+# PNG: zlib level 1 (slightly bigger files, much faster encode). JPEG: same quality PIL used by default.
+WRITE_PARAMS = {
+    ".png": [cv2.IMWRITE_PNG_COMPRESSION, 1],
+    ".jpg": [cv2.IMWRITE_JPEG_QUALITY, 75],
+    ".jpeg": [cv2.IMWRITE_JPEG_QUALITY, 75],
+}
 
-def resize_stretch(im: Image.Image, size: Tuple[int, int], is_mask: bool) -> Image.Image:
-    resample = Image.NEAREST if is_mask else Image.BILINEAR
-    return im.resize(size, resample=resample)
+def iter_media_files(folder: Path, exts: Set[str]) -> Iterable[Path]:
+    stack = [str(folder)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(e.path)
+                    continue
+                name = e.name
+                if name.startswith("."):
+                    continue
+                dot = name.rfind(".")
+                if dot > 0 and name[dot:].lower() in exts and e.is_file():
+                    yield Path(e.path)
 
-def resize_keep_aspect(im: Image.Image, size: Tuple[int, int], is_mask: bool) -> Image.Image:
+def _load_with_pil(p: Path, is_mask: bool) -> np.ndarray:
+    # Fallback for formats the cv2 build cannot decode (e.g. webp)
+    with Image.open(p) as im:
+        if is_mask:
+            # JPEG: decode straight to grayscale (no-op for other formats)
+            im.draft("L", im.size)
+            return np.asarray(im.convert("L"))
+        if im.mode not in ("L", "RGB", "RGBA", "I;16"):
+            im = im.convert("RGBA" if im.has_transparency_data else "RGB")
+        arr = np.asarray(im)
+    # keep OpenCV channel order (BGR/BGRA) so the rest of the pipeline is uniform
+    if arr.ndim == 3:
+        code = cv2.COLOR_RGBA2BGRA if arr.shape[2] == 4 else cv2.COLOR_RGB2BGR
+        arr = cv2.cvtColor(arr, code)
+    return arr
+
+def jpeg_draft_flag(
+    p: Path, size: Tuple[int, int], is_mask: bool
+) -> Optional[Tuple[int, Tuple[int, int]]]:
+    """
+    For JPEGs, pick the largest DCT scale that still decodes to >= size in both
+    dimensions, so libjpeg skips the detail the resize would throw away anyway.
+    Returns (imread flag, full (w, h) from the header), or None when no reduction applies.
+    """
+    if p.suffix.lower() not in JPEG_EXTS:
+        return None
+    # reads the header only, no pixel decode
+    with Image.open(p) as im:
+        (w, h), gray = im.size, im.mode == "L"
     target_w, target_h = size
-    w, h = im.size
-    scale = min(target_w / w, target_h / h)
-    new_w, new_h = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+    for factor, (gray_flag, color_flag) in REDUCED_FLAGS.items():
+        if -(-w // factor) >= target_w and -(-h // factor) >= target_h:
+            # reduced decodes apply EXIF orientation unless told not to
+            return (gray_flag if is_mask or gray else color_flag) | cv2.IMREAD_IGNORE_ORIENTATION, (w, h)
+    return None
 
-    resample = Image.NEAREST if is_mask else Image.BILINEAR
-    resized = im.resize((new_w, new_h), resample=resample)
+def load_image(
+    p: Path, is_mask: bool, size: Optional[Tuple[int, int]] = None
+) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Returns (array, source (w, h)). The source size is the file's, even when a
+    reduced JPEG decode makes the array smaller.
+    """
+    # JPEG masks (always 8-bit) are decoded straight to 1 channel. Everything else keeps
+    # its channels and bit depth: IMREAD_GRAYSCALE would drop the low byte of 16-bit masks.
+    is_jpeg_mask = is_mask and p.suffix.lower() in JPEG_EXTS
+    flags = cv2.IMREAD_GRAYSCALE if is_jpeg_mask else cv2.IMREAD_UNCHANGED
+    # Never apply EXIF orientation (PIL never did): an image and its mask must keep the same geometry.
+    flags |= cv2.IMREAD_IGNORE_ORIENTATION
+    src_size = None
+    if size is not None:
+        draft = jpeg_draft_flag(p, size, is_mask)
+        if draft is not None:
+            flags, src_size = draft
+    arr = cv2.imread(str(p), flags)
+    if arr is None:
+        arr = _load_with_pil(p, is_mask)
+    return arr, src_size or arr.shape[1::-1]
 
-    # Create padded canvas
+def save_image(dst: Path, arr: np.ndarray) -> None:
+    try:
+        ok = cv2.imwrite(str(dst), arr, WRITE_PARAMS.get(dst.suffix.lower(), []))
+    except cv2.error:
+        ok = False
+    if not ok:
+        # Fallback for formats the cv2 build cannot encode
+        if arr.ndim == 3:
+            code = cv2.COLOR_BGRA2RGBA if arr.shape[2] == 4 else cv2.COLOR_BGR2RGB
+            arr = cv2.cvtColor(arr, code)
+        Image.fromarray(arr).save(dst)
+
+def _interpolation(src_size: Tuple[int, int], dst_size: Tuple[int, int], is_mask: bool) -> int:
     if is_mask:
-        # masks: single channel preferred; if not, still fill with 0
-        mode = "L" if resized.mode == "L" else resized.mode
-        canvas = Image.new(mode, (target_w, target_h), 0)
-    else:
-        # images: fill black
-        mode = "RGB" if resized.mode == "RGB" else resized.mode
-        fill = 0 if mode in ("L", "I;16") else (0, 0, 0)
-        canvas = Image.new(mode, (target_w, target_h), fill)
+        # nearest keeps mask labels intact (EXACT matches PIL's pixel-center sampling)
+        return cv2.INTER_NEAREST_EXACT
+    # INTER_AREA antialiases when shrinking, like PIL's BILINEAR does
+    if dst_size[0] < src_size[0] or dst_size[1] < src_size[1]:
+        return cv2.INTER_AREA
+    return cv2.INTER_LINEAR
 
-    # center paste
+def resize_stretch(arr: np.ndarray, size: Tuple[int, int], is_mask: bool) -> np.ndarray:
+    h, w = arr.shape[:2]
+    return cv2.resize(arr, size, interpolation=_interpolation((w, h), size, is_mask))
+
+def fit_with_padding(
+    w: int, h: int, size: Tuple[int, int]
+) -> Tuple[Tuple[int, int], Tuple[int, int, int, int]]:
+    """
+    Keep-aspect layout for a (w, h) image inside size.
+    Returns ((new_w, new_h), (top, bottom, left, right)) padding that centers it.
+    """
+    target_w, target_h = size
+    scale = min(target_w / w, target_h / h)
+    new_w, new_h = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
     left = (target_w - new_w) // 2
     top = (target_h - new_h) // 2
-    canvas.paste(resized, (left, top))
+    right = target_w - new_w - left
+    bottom = target_h - new_h - top
+    return (new_w, new_h), (top, bottom, left, right)
+
+def resize_keep_aspect(arr: np.ndarray, size: Tuple[int, int], is_mask: bool) -> np.ndarray:
+    target_w, target_h = size
+    h, w = arr.shape[:2]
+    (new_w, new_h), (top, _, left, _) = fit_with_padding(w, h, size)
+
+    interpolation = _interpolation((w, h), (new_w, new_h), is_mask)
+    resized = cv2.resize(arr, (new_w, new_h), interpolation=interpolation)
+
+    # center on a black (0) canvas: masks get background, images get black bars
+    canvas = np.zeros((target_h, target_w) + resized.shape[2:], dtype=resized.dtype)
+    if canvas.ndim == 3 and canvas.shape[2] == 4:
+        # BGRA: opaque bars, as PIL's Image.new("RGBA", size, (0, 0, 0)) gave
+        canvas[..., 3] = np.iinfo(canvas.dtype).max if canvas.dtype.kind in "ui" else 1
+    canvas[top:top + new_h, left:left + new_w] = resized
     return canvas
 
-def ensure_mask_mode(im: Image.Image) -> Image.Image:
+def ensure_mask_mode(arr: np.ndarray) -> np.ndarray:
+    """
+    Prefer single-channel 8-bit for masks. If it has color channels, convert to gray
+    (no binarization here); wider dtypes (16-bit, float) saturate to 0..255 like PIL's convert("L").
+    """
+    if arr.ndim == 3:
+        code = cv2.COLOR_BGRA2GRAY if arr.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        arr = cv2.cvtColor(arr, code)
+    if arr.dtype != np.uint8:
+        arr = np.clip(arr, 0, 255).astype(np.uint8)
+    return arr
+
+def output_path(src: Path, in_dir: Path, out_dir: Optional[Path]) -> Path:
+    if out_dir:
+        dst = out_dir / src.relative_to(in_dir)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        return dst
+    return src
+
+def write_result(
+    src: Path, dst: Path, in_size: Tuple[int, int], out_img: np.ndarray, is_mask: bool, dry_run: bool
+) -> None:
+    if dry_run:
+        out_size = out_img.shape[1::-1]
+        print(f"[DRY] {src} -> {dst} size {in_size} -> {out_size} (mask={is_mask})")
+    else:
+        if is_mask: dst = dst.with_suffix(".png")
+        save_image(dst, out_img)
+
+def init_worker() -> None:
+    # one cv2 thread per worker process: the pool already uses every CPU
+    cv2.setNumThreads(1)
+
+def process_file(
+    src: Path,
+    in_dir: Path,
+    out_dir: Optional[Path],
+    size: Tuple[int, int],
+    keep_aspect: bool,
+    is_mask: bool,
+    dry_run: bool,
+) -> bool:
+    """
+    Resize a single file. Returns True if processed, False if skipped.
+    Runs inside a worker process, so it must stay a module-level function.
+    """
+    try:
+        im, in_size = load_image(src, is_mask, size)
+        if is_mask:
+            im = ensure_mask_mode(im)
+
+        if keep_aspect:
+            out_img = resize_keep_aspect(im, size, is_mask)
+        else:
+            out_img = resize_stretch(im, size, is_mask)
+
+        write_result(src, output_path(src, in_dir, out_dir), in_size, out_img, is_mask, dry_run)
+        return True
+    except Exception as e:
+        print(f"[WARN] Skip {src}: {e}")
+        return False
+
+def _load_for_batch(
+    src: Path, size: Tuple[int, int], is_mask: bool
+) -> Optional[Tuple[np.ndarray, Tuple[int, int]]]:
+    try:
+        im, in_size = load_image(src, is_mask, size)
+        return (ensure_mask_mode(im) if is_mask else im), in_size
+    except Exception as e:
+        print(f"[WARN] Skip {src}: {e}")
+        return None
+
+def _write_for_batch(
+    item: Tuple[Path, Tuple[int, int], np.ndarray],
+    in_dir: Path,
+    out_dir: Optional[Path],
+    is_mask: bool,
+    dry_run: bool,
+) -> bool:
+    src, in_size, out_img = item
+    try:
+        write_result(src, output_path(src, in_dir, out_dir), in_size, out_img, is_mask, dry_run)
+        return True
+    except Exception as e:
+        print(f"[WARN] Skip {src}: {e}")
+        return False
+
+def resize_batch_torch(
+    batch: np.ndarray, size: Tuple[int, int], keep_aspect: bool, is_mask: bool, device: str
+) -> np.ndarray:
+    """
+    Resize a stacked uint8 batch (N,H,W) or (N,H,W,C) on `device` in one call.
+    """
+    # imported here: torch takes seconds to import and only --device cuda needs it
+    import torch
+    import torch.nn.functional as nnf
+    from torchvision.transforms import InterpolationMode
+    from torchvision.transforms.v2 import functional as TF
+
+    n, h, w = batch.shape[:3]
+    t = torch.from_numpy(batch)
+    if device.startswith("cuda"):
+        t = t.pin_memory()
+    t = t.to(device, non_blocking=True)
+    # torchvision works on (N,C,H,W)
+    t = t.unsqueeze(1) if batch.ndim == 3 else t.permute(0, 3, 1, 2)
+
+    if keep_aspect:
+        (new_w, new_h), (top, bottom, left, right) = fit_with_padding(w, h, size)
+    else:
+        (new_w, new_h), (top, bottom, left, right) = size, (0, 0, 0, 0)
+
+    # masks: nearest keeps labels intact. At non-integer ratios its sample grid can
+    # differ from cv2's INTER_NEAREST by one source pixel, so edges may shift a pixel.
+    interpolation = InterpolationMode.NEAREST_EXACT if is_mask else InterpolationMode.BILINEAR
+    t = TF.resize(t, [new_h, new_w], interpolation=interpolation, antialias=True)
+    if keep_aspect:
+        # center on a black (0) canvas; BGRA bars stay opaque like the cv2 path
+        pad = (left, right, top, bottom)
+        if t.shape[1] == 4:
+            t = torch.cat([nnf.pad(t[:, :3], pad, value=0), nnf.pad(t[:, 3:], pad, value=255)], dim=1)
+        else:
+            t = nnf.pad(t, pad, value=0)
+
+    t = t.squeeze(1) if batch.ndim == 3 else t.permute(0, 2, 3, 1)
+    return t.contiguous().cpu().numpy()
+
+def process_dir_torch(
+    in_dir: Path,
+    files: List[Path],
+    out_dir: Optional[Path],
+    size: Tuple[int, int],
+    keep_aspect: bool,
+    is_mask: bool,
+    dry_run: bool,
+    workers: Optional[int],
+    device: str,
+    batch_size: int,
+) -> Tuple[int, int]:
     """
-    Prefer single-channel for masks. If it's RGB, convert to L (no binarization here).
+    GPU path: decode/encode run on CPU threads (cv2 releases the GIL) while
+    same-shape uint8 images are stacked and resized together on `device`.
+    Other dtypes (e.g. 16-bit TIFF) keep the cv2 resize to preserve precision.
     """
-    if im.mode != "L":
-        return im.convert("L")
-    return im
+    load = partial(_load_for_batch, size=size, is_mask=is_mask)
+    write = partial(_write_for_batch, in_dir=in_dir, out_dir=out_dir, is_mask=is_mask, dry_run=dry_run)
+    resize_cpu = resize_keep_aspect if keep_aspect else resize_stretch
+
+    count = skipped = 0
+    with ThreadPoolExecutor(max_workers=workers) as io:
+        for i in range(0, len(files), batch_size):
+            chunk = files[i:i + batch_size]
+            by_shape: Dict[Tuple[Tuple[int, ...], np.dtype], List[Tuple[Path, Tuple[int, int], np.ndarray]]] = {}
+            for src, loaded in zip(chunk, io.map(load, chunk)):
+                if loaded is None:
+                    skipped += 1
+                    continue
+                arr, in_size = loaded
+                by_shape.setdefault((arr.shape, arr.dtype), []).append((src, in_size, arr))
+
+            items = []
+            for (_, dtype), group in by_shape.items():
+                if dtype == np.uint8:
+                    try:
+                        outs = resize_batch_torch(
+                            np.stack([a for _, _, a in group]), size, keep_aspect, is_mask, device
+                        )
+                    except Exception as e:  # e.g. CUDA out of memory: skip the batch, like a file
+                        print(f"[WARN] Skip batch of {len(group)} ({group[0][0]} ...): {e}")
+                        skipped += len(group)
+                        continue
+                else:
+                    outs = [resize_cpu(a, size, is_mask) for _, _, a in group]
+                items.extend((src, in_size, out) for (src, in_size, _), out in zip(group, outs))
+
+            for ok in io.map(write, items):
+                count += ok
+                skipped += not ok
+
+    return (count, skipped)
 
 def process_dir(
     in_dir: Path,
@@ -58,45 +347,44 @@ def process_dir(
     keep_aspect: bool,
     is_mask: bool,
     dry_run: bool,
+    workers: Optional[int] = None,
+    device: str = "cpu",
+    batch_size: int = 32,
 ) -> Tuple[int, int]:
     if not in_dir or not in_dir.is_dir():
         return (0, 0)
 
-    files = [p for p in in_dir.rglob("*") if is_image_file(p)]
+    files = list(iter_media_files(in_dir, IMG_EXTS))
     if not files:
         print(f"[WARN] No images found in: {in_dir}")
         return (0, 0)
 
-    count = 0
-    skipped = 0
-    for src in files:
-        try:
-            im = load_image(src)
-            if is_mask:
-                im = ensure_mask_mode(im)
-
-            if keep_aspect:
-                out_img = resize_keep_aspect(im, size, is_mask)
-            else:
-                out_img = resize_stretch(im, size, is_mask)
-
-            if out_dir:
-                dst = out_dir / src.relative_to(in_dir)
-                dst.parent.mkdir(parents=True, exist_ok=True)
-            else:
-                dst = src
-
-            if dry_run:
-                print(f"[DRY] {src} -> {dst} size {im.size} -> {out_img.size} (mask={is_mask})")
-            else:
-                if is_mask: dst = dst.with_suffix(".png")
-                out_img.save(dst)
-
-            count += 1
-        except Exception as e:
-            print(f"[WARN] Skip {src}: {e}")
-            skipped += 1
+    if device == "cuda":
+        try:  # optional: torch is only imported for --device cuda
+            import torch
+        except ImportError:
+            torch = None
+        if torch is not None and find_spec("torchvision") is not None and torch.cuda.is_available():
+            return process_dir_torch(
+                in_dir, files, out_dir, size, keep_aspect, is_mask, dry_run, workers, device, batch_size
+            )
+        print("[WARN] CUDA not available (needs torch + torchvision with CUDA); using CPU")
+
+    # Files are independent: decode + resize + encode run in parallel processes
+    worker = partial(
+        process_file,
+        in_dir=in_dir,
+        out_dir=out_dir,
+        size=size,
+        keep_aspect=keep_aspect,
+        is_mask=is_mask,
+        dry_run=dry_run,
+    )
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as ex:
+        results = list(ex.map(worker, files, chunksize=16))
 
+    count = sum(results)
+    skipped = len(results) - count
     return (count, skipped)
 
 def main():
@@ -108,12 +396,18 @@ def main():
     ap.add_argument("--size", type=int, default=256, help="Target size (square). Default: 256")
     ap.add_argument("--keep-aspect", action="store_true", help="Keep aspect ratio with padding")
     ap.add_argument("--dry-run", action="store_true", help="Print actions without writing files")
+    ap.add_argument("--workers", type=int, default=os.cpu_count(),
+                    help="Number of worker processes (default: CPU count)")
+    ap.add_argument("--device", choices=("cpu", "cuda"), default="cpu",
+                    help="Resize on CPU (OpenCV) or in batches on CUDA (needs torch + torchvision)")
+    ap.add_argument("--batch-size", type=int, default=32, help="Images per GPU batch (--device cuda). Default: 32")
     args = ap.parse_args()
 
     if not args.img_dir and not args.mask_dir:
         raise SystemExit("[ERROR] Provide at least --img-dir or --mask-dir")
 
     size = (args.size, args.size)
+    workers = max(1, args.workers or 1)
 
     total_done = total_skip = 0
 
@@ -121,7 +415,8 @@ def main():
         out_img = args.out_img if args.out_img else None
         if out_img:
             out_img.mkdir(parents=True, exist_ok=True)
-        done, skip = process_dir(args.img_dir, out_img, size, args.keep_aspect, False, args.dry_run)
+        done, skip = process_dir(args.img_dir, out_img, size, args.keep_aspect, False, args.dry_run,
+                                 workers, args.device, max(1, args.batch_size))
         print(f"[IMAGES] processed={done}, skipped={skip}")
         total_done += done; total_skip += skip
 
@@ -129,7 +424,8 @@ def main():
         out_mask = args.out_mask if args.out_mask else None
         if out_mask:
             out_mask.mkdir(parents=True, exist_ok=True)
-        done, skip = process_dir(args.mask_dir, out_mask, size, args.keep_aspect, True, args.dry_run)
+        done, skip = process_dir(args.mask_dir, out_mask, size, args.keep_aspect, True, args.dry_run,
+                                 workers, args.device, max(1, args.batch_size))
         print(f"[MASKS ] processed={done}, skipped={skip}")
         total_done += done; total_skip += skip
 
@@ -156,6 +452,12 @@ python resize_dataset_256.py \
   --out-mask /home/ivan/Downloads/img_resized_512/output/mask_r \
   --keep-aspect
 
+# Redimensionar en GPU por lotes (requiere torch + torchvision con CUDA):
+python resize_dataset_256.py \
+  --img-dir /ruta/output/img \
+  --mask-dir /ruta/output/mask \
+  --keep-aspect --device cuda
+
 # Ensayo sin escribir nada:
 python resize_dataset_256.py \
   --img-dir /ruta/output/img \